@@ -1,5 +1,6 @@
 import enum
 from enum import Enum
+from typing import Dict
 
 
 class ErrorKind(Enum):
@@ -11,15 +12,17 @@ class ErrorKind(Enum):
     FRAGMENTATION_NOT_SUPPORTED = enum.auto()
 
 
+_MESSAGES: Dict[ErrorKind, str] = {
+    ErrorKind.VERSION_MISMATCH: "version mismatch",
+    ErrorKind.INVALID_AUTH_METHOD: "invalid auth method",
+    ErrorKind.INVALID_ADDRESS_TYPE: "invalid address type",
+    ErrorKind.INVALID_COMMAND: "invalid command",
+    ErrorKind.INVALID_DOMAIN_NAME: "invalid domain name",
+    ErrorKind.FRAGMENTATION_NOT_SUPPORTED: "fragmentation not supported",
+}
+
+
 class SocksError(Exception):
     def __init__(self, kind: ErrorKind) -> None:
         self.kind = kind
-        messages = {
-            ErrorKind.VERSION_MISMATCH: "version mismatch",
-            ErrorKind.INVALID_AUTH_METHOD: "invalid auth method",
-            ErrorKind.INVALID_ADDRESS_TYPE: "invalid address type",
-            ErrorKind.INVALID_COMMAND: "invalid command",
-            ErrorKind.INVALID_DOMAIN_NAME: "invalid domain name",
-            ErrorKind.FRAGMENTATION_NOT_SUPPORTED: "fragmentation not supported",
-        }
-        super().__init__(messages.get(kind, "unknown error"))
+        super().__init__(_MESSAGES.get(kind, "unknown error"))
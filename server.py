@@ -4,6 +4,11 @@ from argparse import ArgumentParser, ArgumentTypeError
 
 import socks
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None  # type: ignore[assignment]
+
 __version__ = "0.1.4"
 
 
@@ -33,12 +38,22 @@ if __name__ == "__main__":
         help="specify bind port [default: %(default)d]",
         metavar="PORT",
     )
+    parser.add_argument(
+        "--reuse-port",
+        action="store_true",
+        help="allow several server processes to share the port (SO_REUSEPORT)",
+    )
     parser.add_argument(
         "-V", "--version", action="version", version=f"%(prog)s {__version__}"
     )
     args = parser.parse_args()
+    loop_factory = uvloop.new_event_loop if uvloop is not None else None
     try:
-        sys.exit(asyncio.run(socks.start_socks_server(args.bind, args.port)))
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            code = runner.run(
+                socks.start_socks_server(args.bind, args.port, args.reuse_port)
+            )
+            sys.exit(code)
     except KeyboardInterrupt:
         print("\nKeyboard interrupt received, exiting.")
         sys.exit(130)
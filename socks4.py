@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import socket
+import struct
 from asyncio import StreamReader, StreamWriter
 from enum import IntEnum
 
@@ -20,13 +21,17 @@ class ReplyCode(IntEnum):
     REQUEST_REJECTED_OR_FAILED = 91
 
 
+_REQUEST_HEADER = struct.Struct("!BH4s")
+_RESPONSES = {rep: bytes((0, rep, 0, 0, 0, 0, 0, 0)) for rep in ReplyCode}
+
+
 async def send_response(writer: StreamWriter, rep: ReplyCode) -> None:
-    writer.write(bytes((0, rep, 0, 0, 0, 0, 0, 0)))
+    writer.write(_RESPONSES[rep])
     await writer.drain()
 
 
 async def handle_connect(
-    reader: StreamReader, writer: StreamWriter, addr: str, port: int
+    reader: StreamReader, writer: StreamWriter, addr: str, port: int, remote_addr: str
 ) -> None:
     try:
         remote_reader, remote_writer = await asyncio.open_connection(addr, port)
@@ -37,30 +42,26 @@ async def handle_connect(
             pass
         raise
     try:
-        sock = remote_writer.get_extra_info("socket")
-        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-    except Exception:
-        pass
-    try:
-        remote_addr = util.format_addr(addr, port)
-        logger.debug(f"tcp://{remote_addr} connected")
+        logger.debug("tcp://%s connected", remote_addr)
         await send_response(writer, ReplyCode.REQUEST_GRANTED)
         await util.copy_bidirectional(reader, writer, remote_reader, remote_writer)
-        logger.debug(f"tcp://{remote_addr} disconnected")
+        logger.debug("tcp://%s disconnected", remote_addr)
     finally:
         await util.close_writer(remote_writer)
 
 
-async def handle_tcp(reader: StreamReader, writer: StreamWriter) -> None:
-    cmd = (await reader.readexactly(1))[0]
-    if cmd not in [Command.CONNECT, Command.BIND]:
+async def handle_tcp(
+    reader: StreamReader, writer: StreamWriter, client_addr: str
+) -> None:
+    cmd, port, data = _REQUEST_HEADER.unpack(
+        await reader.readexactly(_REQUEST_HEADER.size)
+    )
+    if cmd != 1 and cmd != 2:
         try:
             await send_response(writer, ReplyCode.REQUEST_REJECTED_OR_FAILED)
         except Exception:
             pass
         raise SocksError(ErrorKind.INVALID_COMMAND)
-    port = int.from_bytes(await reader.readexactly(2))
-    data = await reader.readexactly(4)
     _user_id = await reader.readuntil(b"\0")
     if data[:3] == bytes([0, 0, 0]) and data[3] != 0:
         data = (await reader.readuntil(b"\0"))[:-1]
@@ -72,13 +73,12 @@ async def handle_tcp(reader: StreamReader, writer: StreamWriter) -> None:
             raise SocksError(ErrorKind.INVALID_DOMAIN_NAME)
     else:
         addr = socket.inet_ntoa(data)
-    client_addr = util.format_addr(*writer.get_extra_info("peername")[:2])
     remote_addr = util.format_addr(addr, port)
     if cmd == Command.CONNECT:
         logger.info(
             f"socks4 connect request from client {client_addr} to tcp://{remote_addr} accepted"
         )
-        await handle_connect(reader, writer, addr, port)
+        await handle_connect(reader, writer, addr, port, remote_addr)
     elif cmd == Command.BIND:
         logger.info(
             f"socks4 bind request from client {client_addr} rejected: not implemented"
@@ -1,8 +1,8 @@
 import socket
-from asyncio import StreamReader, StreamWriter
+import struct
+from asyncio import StreamReader
 from enum import IntEnum
-from io import BytesIO
-from ipaddress import IPv4Address, IPv6Address
+from typing import Optional
 
 from error import ErrorKind, SocksError
 
@@ -13,73 +13,102 @@ class AddrType(IntEnum):
     IP_V6 = 0x04
 
 
+_IP_V4 = struct.Struct("!B4sH")
+_IP_V6 = struct.Struct("!B16sH")
+_PORT = struct.Struct("!H")
+_IP_V4_BODY = struct.Struct("!4sH")
+_IP_V6_BODY = struct.Struct("!16sH")
+
+
 class Address:
     def __init__(self, addr: str = "0.0.0.0", port: int = 0) -> None:
+        self.addr = addr
         try:
-            self.type = AddrType.IP_V4
-            self.addr = str(IPv4Address(addr))
-        except Exception:
+            socket.inet_pton(socket.AF_INET, addr)
+            self.type: int = AddrType.IP_V4
+        except OSError:
             try:
+                socket.inet_pton(socket.AF_INET6, addr)
                 self.type = AddrType.IP_V6
-                self.addr = str(IPv6Address(addr))
-            except Exception:
+            except OSError:
                 self.type = AddrType.DOMAIN_NAME
-                self.addr = addr
         self.port = port
 
-    async def read_from(self, reader: StreamReader) -> None:
-        self.type = AddrType((await reader.readexactly(1))[0])
+    @classmethod
+    def from_sockaddr(cls, addr: str, port: int) -> "Address":
+        # Addresses reported by the socket layer are already valid IP literals.
+        self = cls.__new__(cls)
+        self.type = AddrType.IP_V6 if ":" in addr else AddrType.IP_V4
+        self.addr = addr
+        self.port = port
+        return self
+
+    async def read_from(
+        self, reader: StreamReader, addr_type: Optional[int] = None
+    ) -> None:
+        if addr_type is None:
+            addr_type = (await reader.readexactly(1))[0]
+        self.type = addr_type
         if self.type == AddrType.IP_V4:
-            self.addr = socket.inet_ntoa(await reader.readexactly(4))
+            data, self.port = _IP_V4_BODY.unpack(
+                await reader.readexactly(_IP_V4_BODY.size)
+            )
+            self.addr = socket.inet_ntoa(data)
         elif self.type == AddrType.DOMAIN_NAME:
             n = (await reader.readexactly(1))[0]
             if n < 1:
                 raise SocksError(ErrorKind.INVALID_DOMAIN_NAME)
-            data = await reader.readexactly(n)
+            data = await reader.readexactly(n + 2)
             try:
-                self.addr = data.decode()
+                self.addr = data[:n].decode()
             except Exception:
                 raise SocksError(ErrorKind.INVALID_DOMAIN_NAME)
+            (self.port,) = _PORT.unpack_from(data, n)
         elif self.type == AddrType.IP_V6:
-            self.addr = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+            data, self.port = _IP_V6_BODY.unpack(
+                await reader.readexactly(_IP_V6_BODY.size)
+            )
+            self.addr = socket.inet_ntop(socket.AF_INET6, data)
         else:
             raise SocksError(ErrorKind.INVALID_ADDRESS_TYPE)
-        self.port = int.from_bytes(await reader.readexactly(2))
-
-    def write_to(self, writer: StreamWriter) -> None:
-        writer.write(self.pack())
 
-    def parse(self, reader: BytesIO) -> None:
-        self.type = AddrType(reader.read(1)[0])
+    def parse(self, mv: memoryview, offset: int = 0) -> int:
+        self.type = mv[offset]
+        offset += 1
         if self.type == AddrType.IP_V4:
-            self.addr = socket.inet_ntoa(reader.read(4))
+            self.addr = socket.inet_ntop(socket.AF_INET, mv[offset : offset + 4])
+            offset += 4
         elif self.type == AddrType.DOMAIN_NAME:
-            n = reader.read(1)[0]
-            if n < 1:
+            n = mv[offset]
+            offset += 1
+            if n < 1 or len(mv) < offset + n:
                 raise SocksError(ErrorKind.INVALID_DOMAIN_NAME)
-            data = reader.read(n)
             try:
-                self.addr = data.decode()
+                self.addr = str(mv[offset : offset + n], "utf-8")
             except Exception:
                 raise SocksError(ErrorKind.INVALID_DOMAIN_NAME)
+            offset += n
         elif self.type == AddrType.IP_V6:
-            self.addr = socket.inet_ntop(socket.AF_INET6, reader.read(16))
+            self.addr = socket.inet_ntop(socket.AF_INET6, mv[offset : offset + 16])
+            offset += 16
         else:
             raise SocksError(ErrorKind.INVALID_ADDRESS_TYPE)
-        self.port = int.from_bytes(reader.read(2))
+        (self.port,) = _PORT.unpack_from(mv, offset)
+        return offset + 2
 
     def pack(self) -> bytes:
-        blocks = [bytes([self.type])]
         if self.type == AddrType.IP_V4:
-            blocks.append(socket.inet_aton(self.addr))
+            return _IP_V4.pack(self.type, socket.inet_aton(self.addr), self.port)
         elif self.type == AddrType.DOMAIN_NAME:
             data = self.addr.encode()
             if not data or len(data) > 255:
                 raise SocksError(ErrorKind.INVALID_DOMAIN_NAME)
-            blocks.append(bytes([len(data)]) + data)
+            return struct.pack(
+                f"!BB{len(data)}sH", self.type, len(data), data, self.port
+            )
         elif self.type == AddrType.IP_V6:
-            blocks.append(socket.inet_pton(socket.AF_INET6, self.addr))
+            return _IP_V6.pack(
+                self.type, socket.inet_pton(socket.AF_INET6, self.addr), self.port
+            )
         else:
             raise SocksError(ErrorKind.INVALID_ADDRESS_TYPE)
-        blocks.append(self.port.to_bytes(2))
-        return b"".join(blocks)
@@ -11,9 +11,8 @@ class Method(IntEnum):
     NO_ACCEPTABLE_AUTH_METHODS = 0xFF
 
 
-async def send_response(writer: StreamWriter, method: Method) -> None:
+def send_response(writer: StreamWriter, method: Method) -> None:
     writer.write(bytes([5, method]))
-    await writer.drain()
 
 
 async def authenticate(reader: StreamReader, writer: StreamWriter) -> bool:
@@ -21,9 +20,9 @@ async def authenticate(reader: StreamReader, writer: StreamWriter) -> bool:
     if n < 1:
         raise SocksError(ErrorKind.INVALID_AUTH_METHOD)
     methods = await reader.readexactly(n)
-    if Method.NO_AUTHENTICATION_REQUIRED in methods:
-        await send_response(writer, Method.NO_AUTHENTICATION_REQUIRED)
+    if 0 in methods:
+        send_response(writer, Method.NO_AUTHENTICATION_REQUIRED)
         return True
     else:
-        await send_response(writer, Method.NO_ACCEPTABLE_AUTH_METHODS)
+        send_response(writer, Method.NO_ACCEPTABLE_AUTH_METHODS)
         return False
@@ -1,6 +1,5 @@
 import asyncio
 import logging
-import socket
 from asyncio import StreamReader, StreamWriter
 from enum import IntEnum
 from typing import Optional, Tuple
@@ -10,7 +9,7 @@ from error import ErrorKind, SocksError
 from util import UDPSession
 
 from . import auth, udp
-from .address import Address
+from .address import AddrType, Address
 
 logger = logging.getLogger(__name__)
 
@@ -33,67 +32,69 @@ class ReplyCode(IntEnum):
     ADDRESS_TYPE_NOT_SUPPORTED = 0x08
 
 
+_COMMANDS = frozenset(Command)
+_UNSPECIFIED_BIND_REPLIES = {
+    rep: bytes([5, rep, 0, AddrType.IP_V4, 0, 0, 0, 0, 0, 0]) for rep in ReplyCode
+}
+
+
 class Reply:
     def __init__(self, rep: ReplyCode, bind: Optional[Address] = None) -> None:
         self.rep = rep
         self.bind = bind if bind is not None else Address()
 
-    async def write_to(self, writer: StreamWriter) -> None:
-        writer.write(bytes([5, self.rep, 0]))
-        self.bind.write_to(writer)
-        await writer.drain()
+    def write_to(self, writer: StreamWriter) -> None:
+        bind = self.bind
+        if bind.type == AddrType.IP_V4 and bind.addr == "0.0.0.0" and bind.port == 0:
+            writer.write(_UNSPECIFIED_BIND_REPLIES[self.rep])
+        else:
+            writer.write(bytes([5, self.rep, 0]) + bind.pack())
 
 
 class Request:
     def __init__(self) -> None:
-        self.cmd: Optional[Command] = None
+        self.cmd: Optional[int] = None
         self.addr = Address()
 
     async def read_from(self, reader: StreamReader, writer: StreamWriter) -> None:
-        ver = (await reader.readexactly(1))[0]
+        ver, cmd, _rsv, addr_type = await reader.readexactly(4)
         if ver != 5:
             raise SocksError(ErrorKind.VERSION_MISMATCH)
-        self.cmd = Command((await reader.readexactly(1))[0])
-        if self.cmd not in [Command.CONNECT, Command.BIND, Command.UDP_ASSOCIATE]:
+        if cmd not in _COMMANDS:
             try:
-                await Reply(ReplyCode.COMMAND_NOT_SUPPORTED).write_to(writer)
+                Reply(ReplyCode.COMMAND_NOT_SUPPORTED).write_to(writer)
             except Exception:
                 pass
             raise SocksError(ErrorKind.INVALID_COMMAND)
-        _rsv = await reader.readexactly(1)
+        self.cmd = cmd
         try:
-            await self.addr.read_from(reader)
+            await self.addr.read_from(reader, addr_type)
         except SocksError as err:
             if err.kind == ErrorKind.INVALID_ADDRESS_TYPE:
                 try:
-                    await Reply(ReplyCode.ADDRESS_TYPE_NOT_SUPPORTED).write_to(writer)
+                    Reply(ReplyCode.ADDRESS_TYPE_NOT_SUPPORTED).write_to(writer)
                 except Exception:
                     pass
             raise
 
 
 async def handle_connect(
-    reader: StreamReader, writer: StreamWriter, addr: str, port: int
+    reader: StreamReader, writer: StreamWriter, addr: str, port: int, remote_addr: str
 ) -> None:
     try:
         remote_reader, remote_writer = await asyncio.open_connection(addr, port)
     except Exception:
         try:
-            await Reply(ReplyCode.GENERAL_SOCKS_SERVER_FAILURE).write_to(writer)
+            Reply(ReplyCode.GENERAL_SOCKS_SERVER_FAILURE).write_to(writer)
         except Exception:
             pass
         raise
     try:
-        sock = remote_writer.get_extra_info("socket")
-        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-    except Exception:
-        pass
-    try:
-        remote_addr = util.format_addr(addr, port)
-        logger.debug(f"tcp://{remote_addr} connected")
-        await Reply(ReplyCode.SUCCEEDED).write_to(writer)
+        logger.debug("tcp://%s connected", remote_addr)
+        Reply(ReplyCode.SUCCEEDED).write_to(writer)
+        await writer.drain()
         await util.copy_bidirectional(reader, writer, remote_reader, remote_writer)
-        logger.debug(f"tcp://{remote_addr} disconnected")
+        logger.debug("tcp://%s disconnected", remote_addr)
     finally:
         await util.close_writer(remote_writer)
 
@@ -108,37 +109,40 @@ async def handle_udp_associate(
                 f"udp packets from client {client_addr} dropped: client ip address not allowed"
             )
             return
-        logger.debug(f"udp session for client {client_addr} opened")
+        logger.debug("udp session for client %s opened", client_addr)
         try:
             await udp.handle_udp(session)
         except Exception as err:
             logger.error(
                 f"failed to handle udp packet from client {client_addr}: {err}"
             )
-        logger.debug(f"udp session for client {client_addr} closed")
+        logger.debug("udp session for client %s closed", client_addr)
 
     try:
         bind_addr = writer.get_extra_info("sockname")[0]
         server = await util.start_udp_server(client_connected_cb, (bind_addr, 0))
     except Exception:
         try:
-            await Reply(ReplyCode.GENERAL_SOCKS_SERVER_FAILURE).write_to(writer)
+            Reply(ReplyCode.GENERAL_SOCKS_SERVER_FAILURE).write_to(writer)
         except Exception:
             pass
         raise
     try:
-        addr = Address(*server.sockets[0].getsockname()[:2])
-        await Reply(ReplyCode.SUCCEEDED, addr).write_to(writer)
-        while await reader.read(16 * 1024):
+        addr = Address.from_sockaddr(*server.sockets[0].getsockname()[:2])
+        Reply(ReplyCode.SUCCEEDED, addr).write_to(writer)
+        while await reader.read(util.COPY_BUF):
             pass
     finally:
         server.close()
         await server.wait_closed()
 
 
-async def handle_tcp(reader: StreamReader, writer: StreamWriter) -> None:
-    peername = writer.get_extra_info("peername")[:2]
-    client_addr = util.format_addr(*peername)
+async def handle_tcp(
+    reader: StreamReader,
+    writer: StreamWriter,
+    peername: Tuple[str, int],
+    client_addr: str,
+) -> None:
     if not await auth.authenticate(reader, writer):
         logger.info(
             f"socks5 request from {client_addr} rejected: authentication failed"
@@ -151,12 +155,14 @@ async def handle_tcp(reader: StreamReader, writer: StreamWriter) -> None:
         logger.info(
             f"socks5 connect request from client {client_addr} to tcp://{remote_addr} accepted"
         )
-        await handle_connect(reader, writer, request.addr.addr, request.addr.port)
+        await handle_connect(
+            reader, writer, request.addr.addr, request.addr.port, remote_addr
+        )
     elif request.cmd == Command.BIND:
         logger.info(
             f"socks5 bind request from client {client_addr} rejected: not implemented"
         )
-        await Reply(ReplyCode.COMMAND_NOT_SUPPORTED).write_to(writer)
+        Reply(ReplyCode.COMMAND_NOT_SUPPORTED).write_to(writer)
     elif request.cmd == Command.UDP_ASSOCIATE:
         logger.info(
             f"socks5 udp associate request from client {client_addr} to udp://{remote_addr} accepted"
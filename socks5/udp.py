@@ -1,13 +1,20 @@
 import asyncio
 import socket
+import struct
 from asyncio import DatagramProtocol
-from io import BytesIO
-from typing import Dict, Optional, Tuple
+from typing import List, Optional, Tuple
 
+import util
 from error import ErrorKind, SocksError
-from util import UDPSession
+from util import AsyncResolverCache, UDPSession
 
-from .address import Address
+from .address import AddrType, Address
+
+resolver = AsyncResolverCache()
+
+_RSV_FRAG = struct.Struct("!HB")
+_IP_V4_HEADER = struct.Struct("!HBB4sH")
+_IP_V6_HEADER = struct.Struct("!HBB16sH")
 
 
 class UDPHeader:
@@ -15,32 +22,56 @@ class UDPHeader:
         self.frag = 0
         self.addr = addr if addr is not None else Address()
 
-    def parse(self, reader: BytesIO) -> None:
-        _rsv = reader.read(2)
-        self.frag = reader.read(1)[0]
+    def parse(self, mv: memoryview) -> int:
+        _rsv, self.frag = _RSV_FRAG.unpack_from(mv, 0)
         if self.frag != 0:
             raise SocksError(ErrorKind.FRAGMENTATION_NOT_SUPPORTED)
-        self.addr.parse(reader)
-
-    def pack(self) -> bytes:
-        return bytes([0, 0, self.frag]) + self.addr.pack()
+        return self.addr.parse(mv, 3)
 
 
 class UDPProtocol(DatagramProtocol):
     def __init__(self, session: UDPSession) -> None:
         self._session = session
+        self._loop = asyncio.get_running_loop()
+        self._pending: List[Tuple[Tuple, bytes]] = []
 
     def datagram_received(self, data: bytes, addr: Tuple) -> None:
         if self._session.is_closing():
             return
-        header = UDPHeader(Address(*addr[:2]))
-        self._session.send(header.pack() + data)
+        if not self._pending:
+            self._loop.call_soon(self._flush)
+        self._pending.append((addr, data))
+        if len(self._pending) >= util.SENDMMSG_BATCH:
+            self._flush()
+
+    def _flush(self) -> None:
+        pending, self._pending = self._pending, []
+        if not pending or self._session.is_closing():
+            return
+        if len(pending) == 1 or not util.SENDMMSG_SUPPORTED:
+            for addr, data in pending:
+                self._send(addr, data)
+            return
+        packets = []
+        for addr, data in pending:
+            header, addr_type, packed = _header_for(addr[0])
+            packets.append((header.pack(0, 0, addr_type, packed, addr[1]), data))
+        self._session.send_many(packets)
+
+    def _send(self, addr: Tuple, data: bytes) -> None:
+        header, addr_type, packed = _header_for(addr[0])
+        self._session.send(header.pack(0, 0, addr_type, packed, addr[1]) + data)
+
+
+def _header_for(host: str) -> Tuple[struct.Struct, int, bytes]:
+    if ":" in host:
+        return _IP_V6_HEADER, AddrType.IP_V6, socket.inet_pton(socket.AF_INET6, host)
+    return _IP_V4_HEADER, AddrType.IP_V4, socket.inet_aton(host)
 
 
 async def handle_udp(session: UDPSession) -> None:
     loop = asyncio.get_event_loop()
     protocol = UDPProtocol(session)
-    resolve_cache: Dict[Tuple[str, int], Tuple] = {}
     transport_v4 = None
     transport_v6 = None
     try:
@@ -54,22 +85,19 @@ async def handle_udp(session: UDPSession) -> None:
             data = await session.recv()
             if data is None:
                 break
-            reader = BytesIO(data)
+            mv = memoryview(data)
             header = UDPHeader()
-            header.parse(reader)
-            data = reader.read()
-            sock_addr = (header.addr.addr, header.addr.port)
-            if sock_addr in resolve_cache:
-                addr_info = resolve_cache[sock_addr]
-            else:
-                addr_info_list = await loop.getaddrinfo(*sock_addr)
-                if not addr_info_list:
-                    raise SocksError(ErrorKind.INVALID_DOMAIN_NAME)
-                addr_info = resolve_cache[sock_addr] = addr_info_list[0]
+            payload = mv[header.parse(mv) :]
+            addr_info_list = await resolver.getaddrinfo(
+                header.addr.addr, header.addr.port
+            )
+            if not addr_info_list:
+                raise SocksError(ErrorKind.INVALID_DOMAIN_NAME)
+            addr_info = addr_info_list[0]
             if addr_info[0] == socket.AF_INET:
-                transport_v4.sendto(data, addr_info[4])
+                transport_v4.sendto(payload, addr_info[4])
             elif addr_info[0] == socket.AF_INET6:
-                transport_v6.sendto(data, addr_info[4])
+                transport_v6.sendto(payload, addr_info[4])
     finally:
         if transport_v4 is not None:
             transport_v4.close()
@@ -1,6 +1,10 @@
 import asyncio
+import ctypes
 import logging
 import os
+import socket
+import struct
+import sys
 import time
 from asyncio import (
     AbstractEventLoop,
@@ -8,34 +12,210 @@ from asyncio import (
     CancelledError,
     DatagramProtocol,
     DatagramTransport,
+    Event,
     Future,
-    Queue,
-    QueueFull,
     StreamReader,
     StreamWriter,
+    Task,
+    TimerHandle,
 )
-from ipaddress import IPv6Address
+from collections import OrderedDict, deque
+from functools import partial
 from logging import LogRecord
-from typing import Awaitable, Callable, Dict, Optional, Tuple
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore[assignment]
+
+COPY_BUF_MIN = 1500
+
+
+def _size_from_env(name: str, default: int, minimum: int = 0) -> int:
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        size = int(value)
+    except ValueError:
+        print(f"{sys.argv[0]}: warning: invalid {name}: {value}", file=sys.stderr)
+        return default
+    if size < minimum:
+        print(
+            f"{sys.argv[0]}: warning: {name} is below {minimum} bytes",
+            file=sys.stderr,
+        )
+        return minimum
+    return size
+
+
+COPY_BUF = _size_from_env("SOCKS_COPY_BUF", 64 * 1024, COPY_BUF_MIN)
+
+TAKE_BYTES_SUPPORTED = hasattr(bytearray, "take_bytes")
+SPLICE_SUPPORTED = hasattr(os, "splice")
+# 0 keeps the kernel's default pipe size. Larger pipes count against the
+# user's pipe-user-pages-soft limit, so they are only used when asked for.
+SPLICE_PIPE_SIZE = _size_from_env("SOCKS_SPLICE_PIPE_SIZE", 0)
+
+
+def _detach_fd_limit() -> int:
+    if resource is None:
+        return sys.maxsize
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return sys.maxsize
+    return soft * 3 // 4
+
+
+# Detached relays need extra descriptors per connection. They are only used
+# while the descriptor table is below this mark, so the last quarter stays
+# available for accepting connections and relaying them with copy().
+DETACH_FD_LIMIT = _detach_fd_limit()
+
+
+def _load_sendmmsg() -> Optional[Any]:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        func = ctypes.CDLL(None, use_errno=True).sendmmsg
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    func.restype = ctypes.c_int
+    return func
+
+
+_sendmmsg = _load_sendmmsg()
+SENDMMSG_SUPPORTED = _sendmmsg is not None
+SENDMMSG_BATCH = 64
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
 
 
 async def close_writer(writer: StreamWriter) -> None:
-    if writer.is_closing():
+    transport = writer.transport
+    if transport is None or transport.is_closing():
         return
     try:
         writer.close()
-        await writer.wait_closed()
+        # With nothing left to flush the transport closes on the next loop
+        # iteration by itself; only wait when data is still pending.
+        if transport.get_write_buffer_size():
+            await writer.wait_closed()
     except Exception:
         pass
 
 
+async def _take(reader: StreamReader, n: int) -> bytes:
+    # Same as StreamReader.read(), except that the chunk is moved out of the
+    # reader's buffer with bytearray.take_bytes() instead of being copied.
+    exc = reader.exception()
+    if exc is not None:
+        raise exc
+    buffer = reader._buffer  # type: ignore[attr-defined]
+    if not buffer and not reader.at_eof():
+        await reader._wait_for_data("read")  # type: ignore[attr-defined]
+    data = buffer.take_bytes(min(n, len(buffer)))
+    reader._maybe_resume_transport()  # type: ignore[attr-defined]
+    return data
+
+
 async def copy(reader: StreamReader, writer: StreamWriter) -> None:
-    while True:
-        data = await reader.read(16 * 1024)
-        if not data or writer.is_closing():
-            break
-        writer.write(data)
-        await writer.drain()
+    read = _take if TAKE_BYTES_SUPPORTED else StreamReader.read
+    is_closing = writer.is_closing
+    writelines = writer.writelines
+    write_buffer_size = writer.transport.get_write_buffer_size
+    queued: List[bytes] = []
+    queued_size = 0
+    drain: Optional[Future] = None
+
+    # Keep reading while a drain is in flight and hand whatever piled up to
+    # the transport in one writelines() once it completes, so small chunks
+    # don't each cost a write/drain round trip.
+    def flush(fut: Optional[Future], data: bytes = b"") -> None:
+        nonlocal drain, queued_size
+        if fut is not drain:
+            return
+        if fut is not None:
+            # A failed drain stays in place for the loop to raise.
+            if not fut.done() or fut.cancelled() or fut.exception() is not None:
+                return
+        drain = None
+        if data:
+            queued.append(data)
+        if not queued or is_closing():
+            return
+        # writelines() lets transports that support it send the chunks with
+        # a single sendmsg() instead of joining them into their write buffer.
+        writelines(queued)
+        queued.clear()
+        queued_size = 0
+        if write_buffer_size():
+            drain = asyncio.ensure_future(writer.drain())
+            drain.add_done_callback(flush)
+
+    try:
+        while True:
+            data = await read(reader, COPY_BUF)
+            if not data or is_closing():
+                break
+            if drain is None or drain.done():
+                if drain is not None:
+                    drain.result()
+                flush(drain, data)
+                continue
+            queued.append(data)
+            queued_size += len(data)
+            if queued_size >= COPY_BUF:
+                fut = drain
+                await fut
+                flush(fut)
+        while drain is not None:
+            fut = drain
+            await fut
+            flush(fut)
+    except CancelledError:
+        # Nothing may be written once the caller has taken over the writer.
+        if drain is not None:
+            drain.cancel()
+        queued.clear()
+        raise
     await close_writer(writer)
 
 
@@ -45,59 +225,472 @@ async def copy_bidirectional(
     reader2: StreamReader,
     writer2: StreamWriter,
 ) -> None:
-    await asyncio.gather(
-        copy(reader1, writer2),
-        copy(reader2, writer1),
+    for writer in (writer1, writer2):
+        try:
+            # With no high-water slack, drain() waits until the kernel has
+            # taken the previous chunk instead of letting the buffer grow.
+            writer.transport.set_write_buffer_limits(0)
+            sock = writer.get_extra_info("socket")
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except Exception:
+            pass
+    if _can_detach(writer1) and _can_detach(writer2):
+        if SPLICE_SUPPORTED:
+            relayed = await splice_bidirectional(reader1, writer1, reader2, writer2)
+        else:
+            relayed = await sock_copy_bidirectional(reader1, writer1, reader2, writer2)
+        if relayed:
+            return
+    relays = {
+        asyncio.ensure_future(copy(reader1, writer2)): writer2,
+        asyncio.ensure_future(copy(reader2, writer1)): writer1,
+    }
+    try:
+        # Once one direction is done the other is torn down rather than left
+        # waiting for its peer to notice.
+        done, pending = await asyncio.wait(relays, return_when=asyncio.FIRST_COMPLETED)
+    except CancelledError:
+        for task in relays:
+            task.cancel()
+        raise
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in pending:
+        writer = relays[task]
+        try:
+            if not writer.is_closing() and writer.can_write_eof():
+                writer.write_eof()
+        except Exception:
+            pass
+        await close_writer(writer)
+    for task in done:
+        task.result()
+
+
+def _can_detach(writer: StreamWriter) -> bool:
+    # The proactor event loop keeps a receive in flight even while reading is
+    # paused, so sockets can only be taken over from readiness-based loops.
+    if os.name != "posix":
+        return False
+    if writer.is_closing() or writer.get_extra_info("sslcontext") is not None:
+        return False
+    sock = writer.get_extra_info("socket")
+    return sock is not None and sock.type == socket.SOCK_STREAM
+
+
+async def _wait_fd(loop: AbstractEventLoop, fd: int, writable: bool) -> None:
+    fut = loop.create_future()
+    if writable:
+        loop.add_writer(fd, fut.set_result, None)
+    else:
+        loop.add_reader(fd, fut.set_result, None)
+    try:
+        await fut
+    finally:
+        if writable:
+            loop.remove_writer(fd)
+        else:
+            loop.remove_reader(fd)
+
+
+async def _splice(
+    loop: AbstractEventLoop,
+    src: socket.socket,
+    dst: socket.socket,
+    pipe_r: int,
+    pipe_w: int,
+) -> None:
+    src_fd = src.fileno()
+    dst_fd = dst.fileno()
+    splice = os.splice
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    size = 64 * 1024
+    if SPLICE_PIPE_SIZE and hasattr(fcntl, "F_SETPIPE_SZ"):
+        try:
+            size = fcntl.fcntl(pipe_w, fcntl.F_SETPIPE_SZ, SPLICE_PIPE_SIZE)
+        except OSError:
+            pass
+    pending = 0
+    while True:
+        if not pending:
+            try:
+                pending = splice(src_fd, pipe_w, size, flags=flags)
+            except BlockingIOError:
+                await _wait_fd(loop, src_fd, False)
+                continue
+            if not pending:
+                break
+        try:
+            pending -= splice(pipe_r, dst_fd, pending, flags=flags)
+        except BlockingIOError:
+            await _wait_fd(loop, dst_fd, True)
+    try:
+        dst.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+async def _sock_copy(
+    loop: AbstractEventLoop, src: socket.socket, dst: socket.socket
+) -> None:
+    buffer = bytearray(COPY_BUF)
+    view = memoryview(buffer)
+    while True:
+        n = await loop.sock_recv_into(src, buffer)
+        if not n:
+            break
+        await loop.sock_sendall(dst, view[:n])
+    try:
+        dst.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _take_buffered(reader: StreamReader) -> bytes:
+    # Bytes the transport already received stay in the reader's buffer and
+    # must be forwarded before the kernel takes over the socket.
+    buffer = reader._buffer  # type: ignore[attr-defined]
+    data = bytes(buffer)
+    buffer.clear()
+    return data
+
+
+def _dup_socket(writer: StreamWriter) -> int:
+    # Event loops such as uvloop hand out socket-like objects that cannot be
+    # duplicated directly, so go through the file descriptor instead.
+    return os.dup(writer.get_extra_info("socket").fileno())
+
+
+def _close_fds(fds: Sequence[int]) -> None:
+    for fd in fds:
+        os.close(fd)
+
+
+# Everything a detached relay needs is allocated before the streams are
+# touched, so running out of file descriptors falls back to copy() instead of
+# resetting a connection that has already been answered.
+def _open_relay_fds(
+    writer1: StreamWriter, writer2: StreamWriter, pipes: bool
+) -> Optional[List[int]]:
+    fds: List[int] = []
+    try:
+        fds.append(_dup_socket(writer1))
+        fds.append(_dup_socket(writer2))
+        if pipes:
+            fds.extend(os.pipe())
+            fds.extend(os.pipe())
+    except OSError:
+        _close_fds(fds)
+        return None
+    # Descriptors are allocated lowest first, so the highest one tells how
+    # full the table is.
+    if max(fds) >= DETACH_FD_LIMIT:
+        _close_fds(fds)
+        return None
+    return fds
+
+
+async def splice_bidirectional(
+    reader1: StreamReader,
+    writer1: StreamWriter,
+    reader2: StreamReader,
+    writer2: StreamWriter,
+) -> bool:
+    fds = _open_relay_fds(writer1, writer2, True)
+    if fds is None:
+        return False
+    sock1 = socket.socket(fileno=fds[0])
+    sock2 = socket.socket(fileno=fds[1])
+    try:
+        await _relay_detached(
+            reader1,
+            writer1,
+            reader2,
+            writer2,
+            sock1,
+            sock2,
+            partial(_splice, pipe_r=fds[2], pipe_w=fds[3]),
+            partial(_splice, pipe_r=fds[4], pipe_w=fds[5]),
+        )
+    finally:
+        _close_fds(fds[2:])
+    return True
+
+
+async def sock_copy_bidirectional(
+    reader1: StreamReader,
+    writer1: StreamWriter,
+    reader2: StreamReader,
+    writer2: StreamWriter,
+) -> bool:
+    fds = _open_relay_fds(writer1, writer2, False)
+    if fds is None:
+        return False
+    sock1 = socket.socket(fileno=fds[0])
+    sock2 = socket.socket(fileno=fds[1])
+    await _relay_detached(
+        reader1, writer1, reader2, writer2, sock1, sock2, _sock_copy, _sock_copy
     )
+    return True
 
 
-def format_addr(addr: str, port: int) -> str:
+async def _relay_detached(
+    reader1: StreamReader,
+    writer1: StreamWriter,
+    reader2: StreamReader,
+    writer2: StreamWriter,
+    sock1: socket.socket,
+    sock2: socket.socket,
+    pump1: Callable[
+        [AbstractEventLoop, socket.socket, socket.socket], Coroutine[Any, Any, None]
+    ],
+    pump2: Callable[
+        [AbstractEventLoop, socket.socket, socket.socket], Coroutine[Any, Any, None]
+    ],
+) -> None:
+    loop = asyncio.get_running_loop()
+    tasks: List[Task] = []
     try:
-        return f"[{IPv6Address(addr)}]:{port}"
-    except Exception:
-        return f"{addr}:{port}"
+        for writer in (writer1, writer2):
+            writer.transport.pause_reading()  # type: ignore[attr-defined]
+            writer.transport.set_write_buffer_limits(0)
+        # Let read callbacks queued before pause_reading() run first.
+        await asyncio.sleep(0)
+        await writer1.drain()
+        await writer2.drain()
+        data1 = _take_buffered(reader1)
+        data2 = _take_buffered(reader2)
+        sock1.setblocking(False)
+        sock2.setblocking(False)
+        if data1:
+            await loop.sock_sendall(sock2, data1)
+        if data2:
+            await loop.sock_sendall(sock1, data2)
+        tasks.append(loop.create_task(pump1(loop, sock1, sock2)))
+        tasks.append(loop.create_task(pump2(loop, sock2, sock1)))
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        sock1.close()
+        sock2.close()
+
+
+def format_addr(addr: str, port: int, validate: bool = False) -> str:
+    if validate:
+        from ipaddress import IPv6Address
+
+        try:
+            return f"[{IPv6Address(addr)}]:{port}"
+        except ValueError:
+            return f"{addr}:{port}"
+    if ":" in addr:
+        return f"[{addr}]:{port}"
+    return f"{addr}:{port}"
+
+
+class AsyncResolverCache:
+    def __init__(self, maxsize: int = 4096, ttl: float = 60.0) -> None:
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._cache: OrderedDict[Tuple[str, int], Tuple[float, List]] = OrderedDict()
+        self._pending: Dict[Tuple[str, int], Task] = {}
+
+    async def getaddrinfo(self, host: str, port: int) -> List:
+        loop = asyncio.get_running_loop()
+        key = (host, port)
+        entry = self._cache.get(key)
+        if entry is not None:
+            expiry, addr_info_list = entry
+            if expiry > loop.time():
+                self._cache.move_to_end(key)
+                return addr_info_list
+            del self._cache[key]
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = loop.create_task(self._resolve(loop, key))
+        return await asyncio.shield(task)
+
+    async def _resolve(self, loop: AbstractEventLoop, key: Tuple[str, int]) -> List:
+        try:
+            addr_info_list = await loop.getaddrinfo(*key)
+        finally:
+            del self._pending[key]
+        self._cache[key] = (loop.time() + self._ttl, addr_info_list)
+        if len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+        return addr_info_list
+
+
+def pack_sockaddr(family: int, addr: Tuple) -> bytes:
+    if family == socket.AF_INET:
+        return (
+            struct.pack("=H", family)
+            + struct.pack("!H", addr[1])
+            + socket.inet_aton(addr[0])
+            + bytes(8)
+        )
+    host = addr[0].partition("%")[0]
+    flowinfo = addr[2] if len(addr) > 2 else 0
+    scope_id = addr[3] if len(addr) > 3 else 0
+    return (
+        struct.pack("=H", family)
+        + struct.pack("!HI", addr[1], flowinfo)
+        + socket.inet_pton(socket.AF_INET6, host)
+        + struct.pack("=I", scope_id)
+    )
+
+
+def sendmmsg(fd: int, packets: Sequence[Sequence[bytes]], sockaddr: bytes) -> int:
+    if _sendmmsg is None:
+        raise OSError("sendmmsg is not supported on this platform")
+    name = ctypes.create_string_buffer(sockaddr, len(sockaddr))
+    msgs = (_MMsgHdr * len(packets))()
+    buffers: List[Any] = []
+    for msg, packet in zip(msgs, packets):
+        iov = (_IOVec * len(packet))()
+        for vec, data in zip(iov, packet):
+            buf = ctypes.c_char_p(data)
+            buffers.append(buf)
+            vec.iov_base = ctypes.cast(buf, ctypes.c_void_p)
+            vec.iov_len = len(data)
+        buffers.append(iov)
+        msg.msg_hdr.msg_name = ctypes.addressof(name)
+        msg.msg_hdr.msg_namelen = len(sockaddr)
+        msg.msg_hdr.msg_iov = iov
+        msg.msg_hdr.msg_iovlen = len(packet)
+    sent = _sendmmsg(fd, msgs, len(packets), socket.MSG_DONTWAIT)
+    if sent < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return sent
 
 
 class UDPSession:
-    def __init__(self, transport: DatagramTransport, addr: Tuple) -> None:
+    def __init__(
+        self,
+        transport: DatagramTransport,
+        addr: Tuple,
+        congestion_cb: Optional[Callable[[bool], None]] = None,
+        queue_size: int = 1024,
+    ) -> None:
         self._transport = transport
         self._addr = addr
-        self._queue: Queue[Optional[bytes]] = Queue(128)
+        self._sockaddr: Optional[bytes] = None
+        self._queue: Deque[Optional[bytes]] = deque()
+        self._queue_size = queue_size
+        self._queue_ready = Event()
+        self._congestion_cb = congestion_cb
+        self._congested = False
+        self._released = False
+        self.last_seen = time.monotonic()
 
     def send(self, data: bytes) -> None:
         if self._transport.is_closing():
             raise RuntimeError("server connection is closed")
+        self.last_seen = time.monotonic()
         self._transport.sendto(data, self._addr)
 
+    def send_many(self, packets: Sequence[Sequence[bytes]]) -> None:
+        if self._transport.is_closing():
+            raise RuntimeError("server connection is closed")
+        self.last_seen = time.monotonic()
+        sent = 0
+        # Only bypass the transport while it has nothing queued, otherwise
+        # packets could overtake the ones it is still waiting to send.
+        queued = self._transport.get_write_buffer_size()  # type: ignore[attr-defined]
+        if SENDMMSG_SUPPORTED and len(packets) > 1 and not queued:
+            sock = self._transport.get_extra_info("socket")
+            try:
+                if self._sockaddr is None:
+                    self._sockaddr = pack_sockaddr(sock.family, self._addr)
+                sent = sendmmsg(sock.fileno(), packets, self._sockaddr)
+            except OSError:
+                pass
+        for packet in packets[sent:]:
+            self._transport.sendto(b"".join(packet), self._addr)
+
     async def recv(self) -> Optional[bytes]:
-        return await self._queue.get()
+        while not self._queue:
+            self._queue_ready.clear()
+            await self._queue_ready.wait()
+        data = self._queue.popleft()
+        if self._congested and len(self._queue) <= self._queue_size // 2:
+            self._set_congested(False)
+        return data
 
     def is_closing(self) -> bool:
         return self._transport.is_closing()
 
     def feed_data(self, data: Optional[bytes]) -> None:
-        try:
-            self._queue.put_nowait(data)
-        except QueueFull:
-            pass
+        # The end-of-session marker is never dropped, or recv() would wait
+        # forever on a full queue.
+        if data is not None:
+            self.last_seen = time.monotonic()
+            if self._released or len(self._queue) >= self._queue_size:
+                return
+        self._queue.append(data)
+        self._queue_ready.set()
+        if not self._congested and len(self._queue) >= self._queue_size:
+            self._set_congested(True)
+
+    # Called once the session's handler has returned. Later datagrams from
+    # the same address are dropped until the session expires, instead of
+    # starting a new handler for each of them.
+    def release(self) -> None:
+        self._released = True
+        self._queue.clear()
+        if self._congested:
+            self._set_congested(False)
+
+    def _set_congested(self, congested: bool) -> None:
+        self._congested = congested
+        if self._congestion_cb is not None:
+            self._congestion_cb(congested)
 
 
 class UDPSessionProtocol(DatagramProtocol):
     def __init__(
         self,
         loop: AbstractEventLoop,
-        client_connected_cb: Callable[[UDPSession, Tuple], Awaitable[None]],
+        client_connected_cb: Union[
+            Callable[[UDPSession, Tuple], Coroutine[Any, Any, None]],
+            Callable[[bytes, Tuple], None],
+        ],
+        max_sessions: int = 1024,
+        session_ttl: float = 300.0,
+        recv_queue_size: int = 1024,
+        raw: bool = False,
     ) -> None:
         self._loop = loop
-        self._client_connected_cb = client_connected_cb
+        self._session_cb: Optional[
+            Callable[[UDPSession, Tuple], Coroutine[Any, Any, None]]
+        ] = None
+        self._datagram_cb: Optional[Callable[[bytes, Tuple], None]] = None
+        if raw:
+            self._datagram_cb = client_connected_cb  # type: ignore[assignment]
+        else:
+            self._session_cb = client_connected_cb  # type: ignore[assignment]
+        self._max_sessions = max_sessions
+        self._session_ttl = session_ttl
+        self._queue_size = recv_queue_size
         self._transport: Optional[DatagramTransport] = None
-        self._sessions: Dict[Tuple, UDPSession] = {}
+        self._sessions: OrderedDict[Tuple, UDPSession] = OrderedDict()
+        self._evict_handle: Optional[TimerHandle] = None
+        self._congested = 0
         self._connection_lost_fut = loop.create_future()
 
     def connection_made(self, transport: BaseTransport) -> None:
         self._transport = transport  # type: ignore[assignment]
+        if self._session_cb is not None:
+            self._schedule_eviction()
 
     def connection_lost(self, exc: Optional[Exception]) -> None:
+        if self._evict_handle is not None:
+            self._evict_handle.cancel()
+            self._evict_handle = None
         for session in self._sessions.values():
             session.feed_data(None)
         if exc is not None:
@@ -106,19 +699,59 @@ class UDPSessionProtocol(DatagramProtocol):
             self._connection_lost_fut.set_result(None)
 
     def datagram_received(self, data: bytes, addr: Tuple) -> None:
-        self._loop.create_task(self._handle_datagram(data, addr))
+        if self._datagram_cb is not None:
+            self._datagram_cb(data, addr)
+            return
+        session = self._sessions.get(addr)
+        if session is not None:
+            self._sessions.move_to_end(addr)
+            session.feed_data(data)
+        elif self._transport is not None and self._session_cb is not None:
+            if len(self._sessions) >= self._max_sessions:
+                _, oldest = self._sessions.popitem(last=False)
+                oldest.feed_data(None)
+            session = self._sessions[addr] = UDPSession(
+                self._transport,
+                addr,
+                self._congestion_changed,
+                queue_size=self._queue_size,
+            )
+            session.feed_data(data)
+            task = self._loop.create_task(self._session_cb(session, addr))
+            task.add_done_callback(lambda _: session.release())
 
     def close_waiter(self) -> Awaitable[None]:
         return self._connection_lost_fut
 
-    async def _handle_datagram(self, data: bytes, addr: Tuple) -> None:
-        if addr in self._sessions:
-            session = self._sessions[addr]
-            session.feed_data(data)
-        elif self._transport is not None:
-            session = self._sessions[addr] = UDPSession(self._transport, addr)
-            session.feed_data(data)
-            await self._client_connected_cb(session, addr)
+    # A session whose queue is full stops reads on the whole socket until it
+    # has caught up, so senders see kernel-level backpressure instead of
+    # their datagrams being dropped here. Transports that can't pause
+    # reading (uvloop) fall back to dropping in feed_data().
+    def _congestion_changed(self, congested: bool) -> None:
+        self._congested += 1 if congested else -1
+        transport = self._transport
+        if transport is None or transport.is_closing():
+            return
+        try:
+            if congested and self._congested == 1:
+                transport.pause_reading()  # type: ignore[attr-defined]
+            elif not congested and self._congested == 0:
+                transport.resume_reading()  # type: ignore[attr-defined]
+        except AttributeError:
+            pass
+
+    def _schedule_eviction(self) -> None:
+        self._evict_handle = self._loop.call_later(
+            self._session_ttl / 2, self._evict_idle_sessions
+        )
+
+    def _evict_idle_sessions(self) -> None:
+        deadline = time.monotonic() - self._session_ttl
+        for addr, session in list(self._sessions.items()):
+            if session.last_seen < deadline:
+                del self._sessions[addr]
+                session.feed_data(None)
+        self._schedule_eviction()
 
 
 class UDPServer:
@@ -185,27 +818,65 @@ class UDPServer:
 
 
 async def start_udp_server(
-    client_connected_cb: Callable[[UDPSession, Tuple], Awaitable[None]],
+    client_connected_cb: Union[
+        Callable[[UDPSession, Tuple], Coroutine[Any, Any, None]],
+        Callable[[bytes, Tuple], None],
+    ],
     local_addr: Optional[Tuple] = None,
     remote_addr: Optional[Tuple] = None,
+    max_sessions: int = 1024,
+    session_ttl: float = 300.0,
+    recv_queue_size: int = 1024,
+    so_rcvbuf: Optional[int] = None,
+    so_sndbuf: Optional[int] = None,
+    raw: bool = False,
     **kwargs,
 ) -> UDPServer:
     loop = asyncio.get_running_loop()
-    protocol = UDPSessionProtocol(loop, client_connected_cb)
+    # In raw mode client_connected_cb is called synchronously with each
+    # datagram and its source address; no sessions are kept.
+    protocol = UDPSessionProtocol(
+        loop, client_connected_cb, max_sessions, session_ttl, recv_queue_size, raw
+    )
     transport, _ = await loop.create_datagram_endpoint(
         lambda: protocol, local_addr, remote_addr, **kwargs
     )
+    # Linux silently caps these at net.core.rmem_max / net.core.wmem_max, so
+    # those sysctls have to be raised for larger values to take effect.
+    sock = transport.get_extra_info("socket")
+    try:
+        if so_rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, so_rcvbuf)
+        if so_sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, so_sndbuf)
+    except Exception:
+        transport.close()
+        raise
     server = UDPServer(loop, transport, protocol)
     return server
 
 
+_LEVEL_NAMES = {
+    name: f"{name:5}" for name in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+}
+
+
 class Formatter(logging.Formatter):
-    converter = time.gmtime
+    def __init__(self) -> None:
+        super().__init__()
+        self._last_second = -1
+        self._last_timestamp = ""
 
     def format(self, record: LogRecord) -> str:
-        timestamp = self.formatTime(record, "%Y-%m-%dT%H:%M:%SZ")
+        second = int(record.created)
+        if second != self._last_second:
+            self._last_timestamp = time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(second)
+            )
+            self._last_second = second
+        levelname = _LEVEL_NAMES.get(record.levelname) or f"{record.levelname:5}"
         formatted = (
-            f"[{timestamp} {record.levelname:5} {record.name}] {record.getMessage()}"
+            f"[{self._last_timestamp} {levelname} {record.name}] {record.getMessage()}"
         )
         if record.exc_info and not record.exc_text:
             record.exc_text = self.formatException(record.exc_info)